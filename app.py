@@ -1,19 +1,28 @@
 import os
+import io
 import sys
-import json
 import time
-import re
 import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 import google.generativeai as genai
 from flask import Flask, render_template
 from flask_socketio import SocketIO, emit
+from llm_cache import LLMCache, DEFAULT_CACHE_PATH
+from rate_limit import TokenBucket, Backoff
+from gemini_errors import DailyQuotaExhausted
+from event_batcher import EventBatcher
+import fast_json
+from mariana_core import GeminiClient, find_best_model, HIGH_QUALITY_MODEL_NAME, RESEARCH_FAILED
 
 # --- Initialization ---
 load_dotenv()
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'secret-key-for-research-agent!'
-socketio = SocketIO(app, async_mode='eventlet', ping_timeout=120, ping_interval=25)
+# Plain threads: the Gemini SDK's blocking sockets would stall an eventlet hub and starve the heartbeat
+socketio = SocketIO(app, async_mode='threading', ping_timeout=120, ping_interval=25, json=fast_json)
+# All progress events go through one batcher so bursts are coalesced and stay in order
+events = EventBatcher(socketio)
 
 # --- Gemini API Configuration ---
 API_KEY = os.getenv("API_KEY")
@@ -22,165 +31,241 @@ if not API_KEY:
     sys.exit(1)
 genai.configure(api_key=API_KEY)
 
-# --- DYNAMIC MODEL FINDER ---
-def find_best_model():
-    """Automatically finds a working model name for this account."""
-    print("🔍 Detecting available models for your API key...")
-    try:
-        available_models = list(genai.list_models())
-        # Priority 1: newer flash models (fast/cheap)
-        for m in available_models:
-            if 'generateContent' in m.supported_generation_methods and 'flash' in m.name.lower() and '1.5' in m.name:
-                 print(f"✅ Auto-selected model: {m.name}")
-                 return m.name
-        # Priority 2: any pro model
-        for m in available_models:
-             if 'generateContent' in m.supported_generation_methods and 'pro' in m.name.lower():
-                 print(f"✅ Auto-selected model: {m.name}")
-                 return m.name
-        # Priority 3: ANY working model
-        for m in available_models:
-             if 'generateContent' in m.supported_generation_methods:
-                 print(f"✅ Auto-selected model: {m.name}")
-                 return m.name
-    except Exception as e:
-        print(f"⚠️ Could not list models ({e}). Defaulting to 'gemini-1.5-flash'")
-    return "gemini-1.5-flash"
+# Set the model once at startup (MARIANA_REFRESH_MODEL=1 forces a fresh probe)
+ACTIVE_MODEL_NAME = find_best_model(refresh=os.getenv("MARIANA_REFRESH_MODEL") == "1")
 
-# Set the model once at startup
-ACTIVE_MODEL_NAME = find_best_model()
+# --- Response Cache (exact + semantic, persisted across restarts) ---
+llm_cache = LLMCache(
+    path=os.getenv("MARIANA_CACHE_PATH", DEFAULT_CACHE_PATH),
+    model_name=ACTIVE_MODEL_NAME,
+    on_stat=lambda stat: events.emit('cache_stat', stat),
+)
 
-# --- Core Research Logic ---
+# --- Gemini Client (model instances, search tool and rate limiter are built once and shared) ---
+# Gemini free tier allows 15 requests per minute
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "15"))
+# Synthesis reuses the active (flash) model; the pro model is only used when explicitly requested
+gemini = GeminiClient(
+    ACTIVE_MODEL_NAME,
+    synthesis_model_name=os.getenv("SYNTHESIS_MODEL", ACTIVE_MODEL_NAME),
+    high_quality_model_name=os.getenv("HIGH_QUALITY_MODEL", HIGH_QUALITY_MODEL_NAME),
+    bucket=TokenBucket(rate=GEMINI_RPM / 60, capacity=GEMINI_RPM, sleep=socketio.sleep),
+    cache=llm_cache,
+    sleep=socketio.sleep,
+)
+MAX_RESEARCH_WORKERS = 3
 
-def brainstorm_sub_topics(topic: str) -> list[str]:
-    model = genai.GenerativeModel(model_name=ACTIVE_MODEL_NAME)
-    prompt = (
-        "You are a research assistant. Break down this main topic into exactly 3 specific, "
-        "answerable sub-topics for a report. Return ONLY a raw JSON array of strings, like this: "
-        '["Topic 1", "Topic 2", "Topic 3"]\n'
-        f'Main Topic: "{topic}"'
-    )
+# --- Background prefetch (opt-in: warms the cache with likely follow-up topics) ---
+# Off by default: each run then spends about six extra Gemini calls of the daily quota
+PREFETCH_ENABLED = os.getenv("MARIANA_PREFETCH", "0") == "1"
+PREFETCH_RPM = float(os.getenv("PREFETCH_RPM", "1"))
+# Skip prefetching when this many cached results are already this close to the topic
+PREFETCH_SKIP_COUNT = 3
+PREFETCH_SIMILARITY = 0.9
+# Same cache, but a slow bucket chained to the interactive one so prefetching never starves a user's run
+prefetch_gemini = GeminiClient(
+    ACTIVE_MODEL_NAME,
+    bucket=TokenBucket(rate=PREFETCH_RPM / 60, capacity=1, sleep=socketio.sleep, parent=gemini.bucket),
+    cache=llm_cache,
+    sleep=socketio.sleep,
+)
+
+# --- Web-specific fallbacks around the shared core ---
+
+def _uses_grounding(use_search: bool) -> bool:
+    """Whether a run takes the grounded per-topic path. Shared by run_research and prefetch so they agree."""
+    return use_search and gemini.search_tool is not None
+
+def brainstorm_sub_topics(topic: str, refresh: bool = False) -> list[str]:
     try:
-        # Try standard generation and manual JSON parsing for maximum compatibility
-        response = model.generate_content(prompt)
-        text = response.text.strip()
-        # Find the first '[' and last ']'
-        start = text.find('[')
-        end = text.rfind(']') + 1
-        if start != -1 and end != -1:
-            json_str = text[start:end]
-            return json.loads(json_str)[:3] # Ensure max 3
-        else:
-             raise ValueError("No JSON array found in response")
+        return gemini.brainstorm_sub_topics(topic, refresh=refresh)
     except Exception as e:
         print(f"Brainstorm fallback used due to: {e}")
         return [f"{topic} - Key Concepts", f"{topic} - Historical Context", f"{topic} - Future Outlook"]
 
-def research_sub_topic_with_retry(sub_topic: str, update_callback=None) -> str:
-    model = genai.GenerativeModel(model_name=ACTIVE_MODEL_NAME)
-    max_retries = 3
-    
-    # Try to find a valid tool definition
-    search_tool = None
+def synthesize_report(main_topic: str, research_data: str, chunk_cb=None, high_quality: bool = False,
+                      refresh: bool = False) -> str:
     try:
-        # Modern approach
-        search_tool = {'google_search': {}}
-        # Test if library accepts this by quickly creating a dummy (not sending)
-        genai.protos.Tool(google_search=genai.protos.GoogleSearch())
-    except:
-        # Fallback for older libraries
-        try: 
-             search_tool = genai.protos.Tool(google_search_retrieval=genai.protos.GoogleSearchRetrieval())
-        except:
-             print("⚠️ No Google Search tool available in this environment.")
-             search_tool = None
-
-    prompt = (
-        "Gather detailed information on this topic. Provide a comprehensive summary (approx 200 words). "
-        "Focus on facts and figures. Cite sources if available."
-        f'\nTopic: "{sub_topic}"'
-    )
+        return gemini.synthesize_report(
+            main_topic, research_data, chunk_cb=chunk_cb, high_quality=high_quality, refresh=refresh
+        )
+    except Exception as e:
+        return f"# Report Error\nCould not synthesize: {e}\n\n## Notes\n{research_data}"
 
-    for attempt in range(1, max_retries + 1):
-        try:
-            if search_tool:
-                # Some older libs need it wrapped in a list, some don't. generic try/except handles it.
-                try:
-                     response = model.generate_content(prompt, tools=[search_tool])
-                except:
-                     # Retry with older tool format if modern dict failed unexpectedly
-                     fallback_tool = genai.protos.Tool(google_search=genai.protos.GoogleSearch())
-                     response = model.generate_content(prompt, tools=[fallback_tool])
-            else:
-                response = model.generate_content(prompt)
-            return response.text
-        except Exception as e:
-            error_str = str(e).lower()
-            
-            if "quota" in error_str or "429" in error_str:
-                m = re.search(r'retry in (\d+)s', error_str)
-                wait_time = int(m.group(1)) + 5 if m else 65
-                msg = f"⚠️ API Rate limit hit. Waiting {wait_time}s..."
-                print(msg)
-                if update_callback: update_callback(msg)
-                time.sleep(wait_time)
-                continue
-
-            if "not supported" in error_str or "unknown field" in error_str:
-                print("Tool not supported. Retrying without tools.")
-                search_tool = None; continue
-
-            print(f"Attempt {attempt} failed for {sub_topic}: {e}")
-            time.sleep(5)
-
-    return "Failed to gather information."
-
-def synthesize_report(main_topic: str, research_data: str) -> str:
-    model = genai.GenerativeModel(model_name=ACTIVE_MODEL_NAME)
-    prompt = (
-        "Synthesize these notes into a Markdown report. Use # for Main Title, ## for sections. "
-        f'Topic: "{main_topic}".\n\n--- Notes ---\n{research_data}'
-    )
+def prefetch(topic: str, sub_topics: list[str], use_search: bool = False):
+    """
+    Researches likely follow-up topics at low priority, into the cache namespace that a run with the
+    same `use_search` setting reads. Only the cache_stat events of its lookups reach the UI.
+    """
+    # Same choice run_research makes, so the entries land where the next run will look
+    grounded = _uses_grounding(use_search)
     try:
-        response = model.generate_content(prompt)
-        return response.text
+        namespace = 'research' if grounded else 'brainstorm_research'
+        if llm_cache.count_similar(namespace, topic, PREFETCH_SIMILARITY) >= PREFETCH_SKIP_COUNT:
+            return
+        backoff = Backoff(sleep=socketio.sleep)
+        for follow_up in prefetch_gemini.suggest_follow_up_topics(topic, sub_topics):
+            if grounded:
+                prefetch_gemini.research_topic(follow_up, backoff=backoff, use_search=True)
+            else:
+                prefetch_gemini.brainstorm_and_research(follow_up)
+    except DailyQuotaExhausted:
+        print("Prefetch stopped: daily quota exhausted.")
     except Exception as e:
-        return f"# Report Error\nCould not synthesize: {e}\n\n## Notes\n{research_data}"
+        print(f"Prefetch failed for {topic}: {e}")
 
 # --- Main Process ---
-def run_research(topic: str):
+def _research_in_one_call(topic: str, refresh: bool = False):
+    """
+    Fast path: one Gemini call, replayed to the UI as the usual events. Returns (sub_topic, summary) pairs or None.
+    `refresh` bypasses the response cache (here and in the other steps) for a forced rerun.
+    """
+    events.emit('status_update', {'message': f'🧠 Brainstorming and researching using {ACTIVE_MODEL_NAME}...'})
+    items = gemini.brainstorm_and_research(
+        topic, lambda msg: events.emit('status_update', {'message': msg}), Backoff(sleep=socketio.sleep),
+        refresh=refresh,
+    )
+    if not items:
+        return None
+    events.emit('sub_topics_generated', {'sub_topics': [{'topic': it['topic'], 'status': 'pending'} for it in items]})
+    for i in range(len(items)):
+        events.emit('sub_topic_update', {'index': i, 'status': 'complete'})
+    return [(it['topic'], it['summary']) for it in items]
+
+def _research_per_sub_topic(topic: str, use_search: bool, refresh: bool = False):
+    """
+    Search-grounded path (also the fallback when the fused answer is unusable): brainstorm, then one
+    call per sub-topic, grounded only if `use_search`. Returns (sub_topic, summary) pairs.
+    """
+    events.emit('status_update', {'message': f'🧠 Brainstorming using {ACTIVE_MODEL_NAME}...'})
+    sub_topics = brainstorm_sub_topics(topic, refresh)
+    events.emit('sub_topics_generated', {'sub_topics': [{'topic': t, 'status': 'pending'} for t in sub_topics]})
+
+    # Research all sub-topics concurrently; the client's token bucket spaces out the actual API calls.
+    def cb_for(i):
+        return lambda msg: events.emit('status_update', {'message': f'[{sub_topics[i]}] {msg}'})
+
+    def partial_for(i):
+        return lambda delta, reset=False: events.emit('sub_topic_partial', {'index': i, 'delta': delta, 'reset': reset})
+
+    events.emit('status_update', {'message': f'🔎 Researching {len(sub_topics)} sub-topics...'})
+    for i in range(len(sub_topics)):
+        events.emit('sub_topic_update', {'index': i, 'status': 'in-progress'})
+
+    summaries = [None] * len(sub_topics)
+    backoff = Backoff(sleep=socketio.sleep)  # shared so one worker's rate-limit cooldown applies to all of them
+    quota_error = None
+    ex = ThreadPoolExecutor(max_workers=MAX_RESEARCH_WORKERS)
     try:
-        socketio.emit('status_update', {'message': f'🧠 Brainstorming using {ACTIVE_MODEL_NAME}...'})
-        sub_topics = brainstorm_sub_topics(topic)
-        socketio.emit('sub_topics_generated', {'sub_topics': [{'topic': t, 'status': 'pending'} for t in sub_topics]})
-
-        results = []
-        for i, sub_topic in enumerate(sub_topics):
-            socketio.emit('status_update', {'message': f'🔎 Researching: {sub_topic} ...'})
-            socketio.emit('sub_topic_update', {'index': i, 'status': 'in-progress'})
-            
-            if i > 0:
-                socketio.emit('status_update', {'message': '⏳ Resting API for 10s...'})
-                time.sleep(10)
-                socketio.emit('status_update', {'message': f'🔎 Researching: {sub_topic} ...'})
-
-            summary = research_sub_topic_with_retry(sub_topic, lambda msg: socketio.emit('status_update', {'message': msg}))
-            
-            if "Failed" in summary and len(summary) < 100:
-                 socketio.emit('sub_topic_update', {'index': i, 'status': 'error'})
-                 results.append(f"## {sub_topic}\n(Research failed)")
+        futures = {
+            ex.submit(
+                gemini.research_topic, st, cb_for(i), backoff,
+                partial_cb=partial_for(i), use_search=use_search, refresh=refresh,
+            ): i
+            for i, st in enumerate(sub_topics)
+        }
+        for fut in as_completed(futures):
+            i = futures[fut]
+            try:
+                summary = fut.result()
+            except DailyQuotaExhausted as e:
+                quota_error = e
+                break
+            except Exception as e:
+                print(f"Research worker failed for {sub_topics[i]}: {e}")
+                summary = RESEARCH_FAILED
+
+            if not summary.strip() or summary == RESEARCH_FAILED:
+                events.emit('sub_topic_update', {'index': i, 'status': 'error'})
             else:
-                 results.append(f"## {sub_topic}\n{summary}")
-                 socketio.emit('sub_topic_update', {'index': i, 'status': 'complete'})
+                summaries[i] = summary
+                events.emit('sub_topic_update', {'index': i, 'status': 'complete'})
+    finally:
+        if quota_error is not None:
+            # Wake workers sleeping through a backoff and don't wait for them before reporting
+            backoff.stop()
+            ex.shutdown(wait=False, cancel_futures=True)
+        else:
+            ex.shutdown(wait=True)
+
+    if quota_error is not None:
+        raise quota_error
+    return list(zip(sub_topics, summaries))
+
+def _report_cache_key(topic: str, use_search: bool, high_quality: bool) -> str:
+    # Hashed by LLMCache; the options are part of the key since they change the report
+    return f"{'search' if use_search else 'fast'}:{'high' if high_quality else 'fast'}\n{topic.strip().lower()}"
+
+def _replay_cached_report(entry: dict):
+    """Re-emits a cached run's events so the UI ends up exactly as after the original run."""
+    events.emit('status_update', {'message': '⚡ Found a recent report on this topic.'})
+    events.emit('sub_topics_generated', {'sub_topics': [{'topic': t, 'status': 'pending'} for t in entry['sub_topics']]})
+    for i in range(len(entry['sub_topics'])):
+        events.emit('sub_topic_update', {'index': i, 'status': 'complete'})
+    events.emit('final_report', {'report': entry['final_report']})
+    events.emit('status_update', {'message': '🎉 Done! (cached)'})
 
-        socketio.emit('status_update', {'message': '✍️ Synthesizing...'})
-        final_report = synthesize_report(topic, "\n\n".join(results))
-        socketio.emit('final_report', {'report': final_report})
-        socketio.emit('status_update', {'message': '🎉 Done!'})
+def run_research(topic: str, use_search: bool = False, high_quality: bool = False, force_refresh: bool = False):
+    try:
+        # Whole-run cache: a repeated topic skips every Gemini call. force_refresh bypasses it and the
+        # per-call caches below, so the rerun really does new work (and overwrites the cached entries)
+        report_key = _report_cache_key(topic, use_search, high_quality)
+        if not force_refresh:
+            entry, _, _ = llm_cache.lookup('report', report_key, semantic=False)
+            if entry:
+                _replay_cached_report(entry)
+                return
+
+        # Search grounding needs one call per sub-topic; otherwise a single fused call is enough
+        findings = None
+        if not _uses_grounding(use_search):
+            findings = _research_in_one_call(topic, force_refresh)
+        if findings is None:
+            findings = _research_per_sub_topic(topic, use_search, force_refresh)
+
+        # Build the notes in one buffer instead of a list of per-topic strings joined afterwards
+        buf = io.StringIO()
+        for sub_topic, summary in findings:
+            buf.write(f"## {sub_topic}\n")
+            buf.write(summary if summary is not None else "(Research failed)")
+            buf.write("\n\n")
+
+        events.emit('status_update', {'message': '✍️ Synthesizing...'})
+        # Stream the report as it is generated, then send the complete text
+        final_report = synthesize_report(
+            topic, buf.getvalue(),
+            chunk_cb=lambda delta: events.emit('report_chunk', {'delta': delta}),
+            high_quality=high_quality,
+            refresh=force_refresh,
+        )
+        events.emit('final_report', {'report': final_report})
+        events.emit('status_update', {'message': '🎉 Done!'})
+
+        # Only complete runs are worth replaying
+        if (all(summary is not None for _, summary in findings) and final_report.strip()
+                and not final_report.startswith("# Report Error")):
+            llm_cache.store('report', report_key, {
+                'sub_topics': [sub_topic for sub_topic, _ in findings],
+                'summaries': [summary for _, summary in findings],
+                'final_report': final_report,
+                'timestamp': time.time(),
+                'model': ACTIVE_MODEL_NAME,
+            })
+
+        if PREFETCH_ENABLED:
+            socketio.start_background_task(prefetch, topic, [sub_topic for sub_topic, _ in findings], use_search)
+
+    except DailyQuotaExhausted as e:
+        print(f"Daily quota exhausted: {e}")
+        events.emit('quota_exhausted', {'message': '🚫 Daily Gemini API quota exhausted. Please try again after it resets.'})
 
     except Exception as e:
         traceback.print_exc()
-        socketio.emit('research_error', {'error': str(e)})
+        events.emit('research_error', {'error': str(e)})
+
+    finally:
+        # Don't leave the final events waiting for the batch timer
+        events.flush()
 
 @app.route('/')
 def index(): return render_template('index.html')
@@ -190,7 +275,10 @@ def on_start(data):
     topic = data.get('topic')
     if topic:
         print(f"Starting research on: {topic}")
-        socketio.start_background_task(run_research, topic)
+        socketio.start_background_task(
+            run_research, topic, bool(data.get('search_grounding')), data.get('quality', 'fast') == 'high',
+            bool(data.get('force_refresh')),
+        )
 
 if __name__ == '__main__':
     socketio.run(app, debug=True, port=5000)
\ No newline at end of file
@@ -0,0 +1,53 @@
+# event_batcher.py
+
+# Coalesces Socket.IO events fired in quick succession into a single 'event_batch' message
+# so each burst is serialized and fanned out to clients once instead of per event.
+
+import threading
+
+BATCH_INTERVAL = 0.05  # seconds
+BATCH_SIZE = 50
+
+
+class EventBatcher:
+    """
+    Collects (event, payload) pairs and flushes them every BATCH_INTERVAL seconds, or as soon as
+    BATCH_SIZE are queued. A lone event is sent as a plain emit, so quiet periods behave as before.
+    Events always reach clients in the order they were emitted.
+    """
+
+    def __init__(self, socketio, interval: float = BATCH_INTERVAL, batch_size: int = BATCH_SIZE):
+        self.socketio = socketio
+        self.interval = interval
+        self.batch_size = batch_size
+        self._events = []
+        self._scheduled = False
+        self._lock = threading.Lock()
+        # held while a batch is taken *and* sent, so concurrent flushes can't reorder batches
+        self._flush_lock = threading.Lock()
+
+    def emit(self, event: str, payload=None):
+        with self._lock:
+            self._events.append((event, payload))
+            full = len(self._events) >= self.batch_size
+            schedule = not full and not self._scheduled
+            if schedule:
+                self._scheduled = True
+        if full:
+            self.flush()
+        elif schedule:
+            self.socketio.start_background_task(self._flush_later)
+
+    def _flush_later(self):
+        self.socketio.sleep(self.interval)
+        self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                events, self._events = self._events, []
+                self._scheduled = False
+            if len(events) == 1:
+                self.socketio.emit(*events[0])
+            elif events:
+                self.socketio.emit('event_batch', [[event, payload] for event, payload in events])
@@ -0,0 +1,14 @@
+# fast_json.py
+
+# orjson behind the stdlib json dumps/loads interface. python-socketio passes stdlib keyword
+# arguments (e.g. separators) and expects str back, so those are accepted and ignored here.
+
+import orjson
+
+
+def dumps(obj, *args, **kwargs) -> str:
+    return orjson.dumps(obj).decode("utf-8")
+
+
+def loads(s, *args, **kwargs):
+    return orjson.loads(s)
@@ -0,0 +1,55 @@
+# gemini_errors.py
+
+# Helpers for reading the structured details Gemini attaches to 429 (TooManyRequests / ResourceExhausted) errors,
+# so callers can honor google.rpc.RetryInfo instead of scraping the error message.
+
+from google.protobuf import duration_pb2
+
+# Extra seconds added on top of the server-provided retryDelay
+RETRY_BUFFER_SECONDS = 2
+
+
+class DailyQuotaExhausted(Exception):
+    """Raised when a 429 reports a per-day quota violation; retrying won't help until it resets."""
+
+
+def _is_daily_violation(text: str) -> bool:
+    text = text.lower()
+    return "perday" in text or "per day" in text or "per_day" in text
+
+
+def parse_retry_info(err):
+    """
+    Walks `err.details` for google.rpc RetryInfo / QuotaFailure entries.
+    Handles both REST-style dicts ({'@type': ..., 'retryDelay': '3s'}) and unpacked gRPC protos.
+    Returns (retry_delay_seconds or None, daily_quota_exhausted).
+    """
+    delay = None
+    daily = False
+    details = getattr(err, "details", None) or getattr(err, "_details", None) or []
+
+    for detail in details:
+        if isinstance(detail, dict):
+            type_url = detail.get("@type", "")
+            if type_url.endswith("RetryInfo") and detail.get("retryDelay"):
+                duration = duration_pb2.Duration()
+                try:
+                    duration.FromJsonString(detail["retryDelay"])
+                    delay = duration.ToTimedelta().total_seconds()
+                except ValueError:
+                    # Malformed delay: leave it to the caller's message/backoff fallback
+                    pass
+            elif type_url.endswith("QuotaFailure"):
+                for v in detail.get("violations", []):
+                    if _is_daily_violation(" ".join(str(v.get(k, "")) for k in ("quotaId", "quotaMetric", "description"))):
+                        daily = True
+        else:
+            name = getattr(getattr(detail, "DESCRIPTOR", None), "name", "")
+            if name == "RetryInfo":
+                delay = detail.retry_delay.ToTimedelta().total_seconds()
+            elif name == "QuotaFailure":
+                for v in detail.violations:
+                    if _is_daily_violation(" ".join(str(getattr(v, k, "")) for k in ("quota_id", "subject", "description"))):
+                        daily = True
+
+    return delay, daily
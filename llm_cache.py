@@ -0,0 +1,206 @@
+# llm_cache.py
+
+# Persistent response cache for Gemini calls.
+# Lookups first try an exact sha256(model + namespace + prompt) hit, then fall back to a
+# semantic hit: the prompt is embedded and compared (cosine similarity) against every
+# cached embedding in the same namespace.
+
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import functools
+import numpy as np
+import google.generativeai as genai
+import fast_json
+
+EMBED_MODEL = "models/text-embedding-004"
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".mariana", "llm_cache.db")
+
+
+class LLMCache:
+    """
+    Stores (embedding, prompt, response, timestamp) rows in SQLite so restarts keep the cache.
+    Embeddings are also kept in memory as one normalized numpy matrix per namespace; the matrix
+    grows by doubling, and expired rows are pruned from it and from SQLite as new entries arrive.
+    """
+
+    # Seconds between two prune passes over the expired rows
+    prune_interval = 60
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, model_name="", threshold=0.92, ttl=3600, on_stat=None):
+        self.model_name = model_name
+        self.threshold = threshold
+        self.ttl = ttl
+        self.on_stat = on_stat
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._index = {}  # namespace -> {'keys': [...], 'ts': [...], 'matrix': np.ndarray, 'size': int}
+        self._last_prune = time.time()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, namespace TEXT, prompt TEXT, response TEXT, embedding BLOB, ts REAL)"
+        )
+        self._db.execute("DELETE FROM entries WHERE ts < ?", (time.time() - self.ttl,))
+        self._db.commit()
+        self._load_index()
+
+    # --- Internal helpers ---
+
+    def _key(self, namespace: str, prompt: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\n{namespace}\n{prompt}".encode("utf-8")).hexdigest()
+
+    def _load_index(self):
+        rows = self._db.execute(
+            "SELECT namespace, key, embedding, ts FROM entries WHERE embedding IS NOT NULL ORDER BY ts"
+        ).fetchall()
+        for namespace, key, blob, ts in rows:
+            self._add_to_index(namespace, key, np.frombuffer(blob, dtype=np.float32), ts)
+
+    def _add_to_index(self, namespace, key, emb, ts):
+        entry = self._index.setdefault(namespace, {'keys': [], 'ts': [], 'matrix': None, 'size': 0})
+        matrix, size = entry['matrix'], entry['size']
+        if matrix is None:
+            matrix = entry['matrix'] = np.empty((16, emb.shape[0]), dtype=np.float32)
+        elif size == len(matrix):
+            # Double the capacity so appends copy the matrix O(log n) times instead of on every store
+            grown = np.empty((2 * len(matrix), matrix.shape[1]), dtype=np.float32)
+            grown[:size] = matrix
+            matrix = entry['matrix'] = grown
+        matrix[size] = emb
+        entry['size'] = size + 1
+        entry['keys'].append(key)
+        entry['ts'].append(ts)
+
+    def _prune(self, now: float):
+        """Drops expired rows from SQLite and the in-memory index. Caller holds the lock."""
+        cutoff = now - self.ttl
+        self._db.execute("DELETE FROM entries WHERE ts < ?", (cutoff,))
+        self._db.commit()
+        for entry in self._index.values():
+            live = np.asarray(entry['ts']) >= cutoff
+            if live.all():
+                continue
+            kept = int(live.sum())
+            entry['matrix'][:kept] = entry['matrix'][:entry['size']][live]
+            entry['size'] = kept
+            entry['keys'] = [k for k, keep in zip(entry['keys'], live) if keep]
+            entry['ts'] = [t for t, keep in zip(entry['ts'], live) if keep]
+        self._last_prune = now
+
+    def _embed(self, text: str):
+        """Returns a unit-length float32 embedding, or None if the embedding call fails."""
+        try:
+            result = genai.embed_content(model=EMBED_MODEL, content=text)
+            emb = np.asarray(result['embedding'], dtype=np.float32)
+            norm = np.linalg.norm(emb)
+            return emb / norm if norm else None
+        except Exception as e:
+            print(f"⚠️ Embedding failed, using exact cache only ({e})")
+            return None
+
+    def _record(self, namespace: str, kind):
+        with self._lock:
+            if kind:
+                self.hits += 1
+            else:
+                self.misses += 1
+            stat = {'function': namespace, 'result': kind or 'miss', 'hits': self.hits, 'misses': self.misses}
+        if self.on_stat:
+            self.on_stat(stat)
+
+    # --- Public API ---
+
+    def lookup(self, namespace: str, prompt: str, semantic: bool = True):
+        """
+        Returns (response, kind, embedding). `kind` is 'exact', 'semantic' or None on a miss;
+        the embedding computed for the semantic lookup is returned so `store` can reuse it.
+        """
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            row = self._db.execute(
+                "SELECT response FROM entries WHERE key = ? AND ts >= ?", (self._key(namespace, prompt), cutoff)
+            ).fetchone()
+        if row:
+            return fast_json.loads(row[0]), 'exact', None
+        if not semantic:
+            return None, None, None
+
+        emb = self._embed(prompt)
+        if emb is None:
+            return None, None, None
+        with self._lock:
+            entry = self._index.get(namespace)
+            if not entry or not entry['size']:
+                return None, None, emb
+            sims = entry['matrix'][:entry['size']] @ emb
+            sims[np.asarray(entry['ts']) < cutoff] = -1.0
+            best = int(np.argmax(sims))
+            if sims[best] <= self.threshold:
+                return None, None, emb
+            row = self._db.execute("SELECT response FROM entries WHERE key = ?", (entry['keys'][best],)).fetchone()
+        if not row:
+            return None, None, emb
+        return fast_json.loads(row[0]), 'semantic', emb
+
+    def count_similar(self, namespace: str, prompt: str, threshold: float = None) -> int:
+        """Number of live entries in `namespace` whose embedding is within `threshold` of the prompt's."""
+        threshold = self.threshold if threshold is None else threshold
+        emb = self._embed(prompt)
+        if emb is None:
+            return 0
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            entry = self._index.get(namespace)
+            if not entry or not entry['size']:
+                return 0
+            sims = entry['matrix'][:entry['size']] @ emb
+            return int(np.count_nonzero((sims >= threshold) & (np.asarray(entry['ts']) >= cutoff)))
+
+    def store(self, namespace: str, prompt: str, response, emb=None):
+        key = self._key(namespace, prompt)
+        ts = time.time()
+        blob = emb.astype(np.float32).tobytes() if emb is not None else None
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (key, namespace, prompt, response, embedding, ts) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, namespace, prompt, fast_json.dumps(response), blob, ts),
+            )
+            self._db.commit()
+            if emb is not None:
+                self._add_to_index(namespace, key, emb, ts)
+            if ts - self._last_prune >= self.prune_interval:
+                self._prune(ts)
+
+    def cached(self, namespace: str, key=None, semantic: bool = True, accept=None):
+        """
+        Decorator caching a function's return value.
+        `key(*args, **kwargs)` builds the text that is hashed/embedded (defaults to the first argument);
+        `accept(result, *args, **kwargs)` can reject results that must not be cached, e.g. error fallbacks.
+        The wrapped function takes an extra `refresh=True` keyword that skips the lookup but still stores.
+        """
+        key = key or (lambda *args, **kwargs: args[0])
+
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, refresh: bool = False, **kwargs):
+                prompt = key(*args, **kwargs)
+                if refresh:
+                    # Recompute and overwrite; the embedding is still needed to index the new entry
+                    value, kind, emb = None, None, self._embed(prompt) if semantic else None
+                else:
+                    value, kind, emb = self.lookup(namespace, prompt, semantic)
+                self._record(namespace, kind)
+                if kind:
+                    return value
+                result = fn(*args, **kwargs)
+                if accept is None or accept(result, *args, **kwargs):
+                    self.store(namespace, prompt, result, emb)
+                return result
+            return wrapper
+        return decorator
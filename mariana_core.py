@@ -0,0 +1,412 @@
+# mariana_core.py
+
+# Gemini research logic shared by the Flask front-end (app.py) and the CLI (research_agent.py):
+# model selection, brainstorming, per-topic research with retries/backoff, and report synthesis.
+
+import os
+import json
+import time
+import re
+import threading
+import google.generativeai as genai
+# TooManyRequests is the base of gRPC's ResourceExhausted; the REST transport raises it directly for HTTP 429
+from google.api_core.exceptions import TooManyRequests
+from gemini_errors import DailyQuotaExhausted, parse_retry_info, RETRY_BUFFER_SECONDS
+from rate_limit import TokenBucket, Backoff
+import fast_json
+
+DEFAULT_MODEL_NAME = "gemini-1.5-flash"
+HIGH_QUALITY_MODEL_NAME = "gemini-2.5-pro"
+RESEARCH_FAILED = "Failed to gather information."
+
+# Delay hints quoted in 429 messages; only consulted when no structured RetryInfo is attached
+_RETRY_RE = re.compile(r'retry in (\d+\.?\d*)s', re.IGNORECASE)
+_RETRY_DELAY_RE = re.compile(r'retry_delay.*?seconds:\s*(\d+)', re.IGNORECASE | re.DOTALL)
+
+# Synthesis prompt pieces; joined around the topic and notes so the notes are copied only once
+_SYNTHESIS_PROMPT_PREFIX = 'Synthesize these notes into a Markdown report. Use # for Main Title, ## for sections. Topic: "'
+_SYNTHESIS_PROMPT_NOTES = '".\n\n--- Notes ---\n'
+
+# Search tool field names in preference order; only those the installed SDK knows are used
+SEARCH_TOOL_CANDIDATES = ["google_search", "google_search_retrieval", "google_search_tool"]
+
+# --- DYNAMIC MODEL FINDER ---
+MODEL_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".mariana", "model_cache.json")
+MODEL_CACHE_TTL = 24 * 60 * 60
+
+def find_best_model(refresh: bool = False):
+    """
+    Returns the model to use. MARIANA_MODEL pins it explicitly; otherwise the last probed
+    name is reused from MODEL_CACHE_PATH for 24h, so most boots skip the list_models() call.
+    """
+    pinned = os.getenv("MARIANA_MODEL")
+    if pinned:
+        print(f"✅ Using pinned model: {pinned}")
+        return pinned
+
+    if not refresh and os.path.exists(MODEL_CACHE_PATH) and time.time() - os.path.getmtime(MODEL_CACHE_PATH) < MODEL_CACHE_TTL:
+        try:
+            with open(MODEL_CACHE_PATH) as fh:
+                name = json.load(fh)['name']
+            print(f"✅ Using cached model: {name}")
+            return name
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠️ Ignoring unreadable model cache ({e})")
+
+    name = _probe_best_model()
+    if name:
+        try:
+            os.makedirs(os.path.dirname(MODEL_CACHE_PATH), exist_ok=True)
+            with open(MODEL_CACHE_PATH, "w") as fh:
+                json.dump({'name': name, 'ts': time.time()}, fh)
+        except OSError as e:
+            print(f"⚠️ Could not write model cache ({e})")
+        return name
+    return DEFAULT_MODEL_NAME
+
+def _model_score(m) -> int:
+    """Selection priority: 1.5 flash (fast/cheap) > any pro > any other working model; 0 if unusable."""
+    if 'generateContent' not in m.supported_generation_methods:
+        return 0
+    name = m.name.lower()
+    if 'flash' in name and '1.5' in name:
+        return 3
+    if 'pro' in name:
+        return 2
+    return 1
+
+def _probe_best_model():
+    """Automatically finds a working model name for this account, or None if listing fails."""
+    print("🔍 Detecting available models for your API key...")
+    try:
+        # One pass; max() keeps the first model of the highest tier, as the old tiered loops did
+        best = max(genai.list_models(), key=_model_score, default=None)
+        if best is not None and _model_score(best) > 0:
+            print(f"✅ Auto-selected model: {best.name}")
+            return best.name
+    except Exception as e:
+        print(f"⚠️ Could not list models ({e}). Defaulting to '{DEFAULT_MODEL_NAME}'")
+    return None
+
+# --- Helpers ---
+
+def _search_tool_candidates() -> list:
+    """Builds a Tool proto for every search tool field this SDK version accepts."""
+    tools = []
+    for tool_name in SEARCH_TOOL_CANDIDATES:
+        # map e.g. "google_search" -> "GoogleSearch"
+        class_name = "".join(part.capitalize() for part in tool_name.split("_"))
+        try:
+            if hasattr(genai.protos, class_name):
+                tools.append(genai.protos.Tool(**{tool_name: getattr(genai.protos, class_name)()}))
+        except Exception:
+            # field unknown to this Tool proto version
+            continue
+    if not tools:
+        print("⚠️ No Google Search tool available in this environment.")
+    return tools
+
+def _is_tool_unsupported(err: Exception) -> bool:
+    s = str(err).lower()
+    return "not supported" in s or "unsupported" in s or "unknown field" in s
+
+def _parse_json_array(text: str) -> list:
+    # Find the first '[' and last ']' so stray prose around the array is tolerated
+    start = text.find('[')
+    end = text.rfind(']') + 1
+    if start == -1 or end == 0:
+        raise ValueError("No JSON array found in response")
+    return fast_json.loads(text[start:end])
+
+def _quota_wait(err: TooManyRequests, attempt: int, backoff: Backoff, last_attempt: bool = False):
+    """
+    Seconds to wait after a 429. Prefers the structured RetryInfo delay, then the delay quoted
+    in the message, then capped exponential backoff. Raises DailyQuotaExhausted when retrying is pointless.
+    With last_attempt, only the daily-quota check runs: returns None and sets no workflow cooldown.
+    """
+    delay, daily_exhausted = parse_retry_info(err)
+    if daily_exhausted:
+        raise DailyQuotaExhausted(str(err)) from err
+    if last_attempt:
+        return None
+    if delay is not None:
+        delay += RETRY_BUFFER_SECONDS
+    else:
+        error_str = str(err)
+        m = _RETRY_RE.search(error_str) or _RETRY_DELAY_RE.search(error_str)
+        delay = float(m.group(1)) + RETRY_BUFFER_SECONDS if m else None
+    return backoff.rate_limit_delay(attempt, delay)
+
+
+class GeminiClient:
+    """
+    Owns the GenerativeModel instances, the memoized search tool and the shared rate limiter.
+    When an LLMCache is given, the public methods are wrapped with it (error results are never cached).
+    """
+
+    def __init__(self, model_name: str, research_model_name: str = None, synthesis_model_name: str = None,
+                 high_quality_model_name: str = HIGH_QUALITY_MODEL_NAME, bucket: TokenBucket = None,
+                 cache=None, sleep=time.sleep, summary_length: str = "approx 200 words"):
+        self.model_name = model_name
+        self.research_model_name = research_model_name or model_name
+        self.synthesis_model_name = synthesis_model_name or model_name
+        self.high_quality_model_name = high_quality_model_name
+        # Target length quoted in the research prompt; the CLI asks for longer summaries than the web app
+        self.summary_length = summary_length
+        # Gemini free tier allows 15 requests per minute
+        self.bucket = bucket or TokenBucket(rate=15 / 60, capacity=15, sleep=sleep)
+        self.sleep = sleep
+        self._models = {}
+        self._models_lock = threading.Lock()
+        self._search_tools = _search_tool_candidates()
+
+        if cache is not None:
+            self.brainstorm_sub_topics = cache.cached('brainstorm')(self.brainstorm_sub_topics)
+            self.suggest_follow_up_topics = cache.cached('follow_ups')(self.suggest_follow_up_topics)
+            self.brainstorm_and_research = cache.cached(
+                'brainstorm_research', accept=lambda items, *args, **kwargs: items is not None
+            )(self.brainstorm_and_research)
+            self.research_topic = cache.cached(
+                'research', accept=lambda summary, *args, **kwargs: bool(summary.strip()) and summary != RESEARCH_FAILED
+            )(self.research_topic)
+            # Synthesis output depends on the full notes, so only exact hits are safe here.
+            self.synthesize_report = cache.cached(
+                'synthesize',
+                key=lambda main_topic, research_data, high_quality=False, **kwargs: (
+                    f"{'high' if high_quality else 'fast'}\n{main_topic}\n{research_data}"
+                ),
+                semantic=False,
+                accept=lambda report, *args, **kwargs: bool(report.strip()),
+            )(self.synthesize_report)
+
+    # --- Model & tool memoization ---
+
+    def model(self, model_name: str = None):
+        """Builds each GenerativeModel once and reuses it for every later call."""
+        model_name = model_name or self.model_name
+        with self._models_lock:
+            if model_name not in self._models:
+                self._models[model_name] = genai.GenerativeModel(model_name=model_name)
+            return self._models[model_name]
+
+    @property
+    def search_tool(self):
+        """
+        The search tool that last worked (or has not failed yet), or None if none is supported.
+        Compare with `is not None`: a Tool proto whose only field is an empty message is falsy.
+        """
+        tools = self._search_tools
+        return tools[0] if tools else None
+
+    def _drop_search_tool(self, tool):
+        # Later calls skip a tool the API rejected and move on to the next candidate
+        self._search_tools = [t for t in self._search_tools if t is not tool]
+
+    # --- Generation ---
+
+    def _generate_text(self, model, prompt, chunk_cb=None, **kwargs) -> str:
+        """Runs generate_content; with a chunk_cb, streams the response and forwards each text delta."""
+        self.bucket.acquire()
+        if not chunk_cb:
+            return model.generate_content(prompt, **kwargs).text
+        parts = []
+        for chunk in model.generate_content(prompt, stream=True, **kwargs):
+            try:
+                text = chunk.text
+            except ValueError:
+                # e.g. chunks that only carry grounding metadata
+                continue
+            parts.append(text)
+            chunk_cb(text)
+        text = "".join(parts)
+        if not text.strip():
+            # e.g. a safety-blocked candidate; fail like .text does in the non-streaming path
+            raise ValueError("empty response")
+        return text
+
+    def brainstorm_sub_topics(self, topic: str, min_topics: int = 3, max_topics: int = 3) -> list[str]:
+        """Breaks a topic down into sub-topics. Raises ValueError if the model's answer is unusable."""
+        count = f"exactly {min_topics}" if min_topics == max_topics else f"{min_topics} to {max_topics}"
+        json_schema = genai.protos.Schema(
+            type=genai.protos.Type.ARRAY,
+            items=genai.protos.Schema(type=genai.protos.Type.STRING)
+        )
+        prompt = (
+            f"You are a research assistant. Break down this main topic into {count} specific, "
+            "answerable sub-topics for a report. Return ONLY a JSON array of strings.\n"
+            f'Main Topic: "{topic}"'
+        )
+        try:
+            self.bucket.acquire()
+            response = self.model().generate_content(
+                prompt,
+                generation_config=genai.types.GenerationConfig(
+                    response_mime_type="application/json",
+                    response_schema=json_schema
+                )
+            )
+            sub_topics = _parse_json_array(response.text.strip())
+        except ValueError:
+            raise
+        except Exception as e:
+            raise ValueError(f"Failed to brainstorm sub-topics: {e}") from e
+        if not sub_topics or not all(isinstance(s, str) for s in sub_topics):
+            raise ValueError("Model returned data in an unexpected format.")
+        return sub_topics[:max_topics]
+
+    def suggest_follow_up_topics(self, topic: str, sub_topics: list[str] = (), count: int = 5) -> list[str]:
+        """Topics a reader of the report is likely to research next. Raises ValueError if the answer is unusable."""
+        json_schema = genai.protos.Schema(
+            type=genai.protos.Type.ARRAY,
+            items=genai.protos.Schema(type=genai.protos.Type.STRING)
+        )
+        covered = "".join(f"\n- {s}" for s in sub_topics)
+        prompt = (
+            f"You are a research assistant. A reader just finished a report on the main topic below. "
+            f"List {count} topics they are most likely to research next, not already covered by the report. "
+            "Return ONLY a JSON array of strings.\n"
+            f'Main Topic: "{topic}"\nCovered:{covered}'
+        )
+        try:
+            self.bucket.acquire()
+            response = self.model().generate_content(
+                prompt,
+                generation_config=genai.types.GenerationConfig(
+                    response_mime_type="application/json",
+                    response_schema=json_schema
+                )
+            )
+            topics = _parse_json_array(response.text.strip())
+        except ValueError:
+            raise
+        except Exception as e:
+            raise ValueError(f"Failed to suggest follow-up topics: {e}") from e
+        if not topics or not all(isinstance(t, str) for t in topics):
+            raise ValueError("Model returned data in an unexpected format.")
+        return topics[:count]
+
+    def brainstorm_and_research(self, topic: str, update_callback=None, backoff: Backoff = None, max_retries: int = 3):
+        """
+        Brainstorms and researches all sub-topics in a single ungrounded call.
+        Returns a list of {'topic', 'summary'} dicts, or None if the answer could not be parsed.
+        Rate limits are waited out like in research_topic (DailyQuotaExhausted included); other API
+        errors propagate, since a per-topic fallback would hit the same endpoint.
+        """
+        json_schema = genai.protos.Schema(
+            type=genai.protos.Type.ARRAY,
+            items=genai.protos.Schema(
+                type=genai.protos.Type.OBJECT,
+                properties={
+                    'topic': genai.protos.Schema(type=genai.protos.Type.STRING),
+                    'summary': genai.protos.Schema(type=genai.protos.Type.STRING),
+                },
+                required=['topic', 'summary'],
+            ),
+        )
+        prompt = (
+            "You are a research assistant. Produce a JSON array of exactly 3 objects with keys 'topic' and 'summary' "
+            "(~200 words each) covering the main topic below. Each topic is a specific, answerable sub-topic for a report; "
+            "each summary focuses on facts and figures.\n"
+            f'Main Topic: "{topic}"'
+        )
+        backoff = backoff or Backoff(sleep=self.sleep)
+        for attempt in range(1, max_retries + 1):
+            backoff.wait()
+            try:
+                self.bucket.acquire()
+                response = self.model().generate_content(
+                    prompt,
+                    generation_config=genai.types.GenerationConfig(
+                        response_mime_type="application/json",
+                        response_schema=json_schema
+                    )
+                )
+                break
+            except TooManyRequests as e:
+                wait_time = _quota_wait(e, attempt, backoff, last_attempt=attempt == max_retries)
+                if wait_time is None:
+                    raise
+                msg = f"⚠️ API Rate limit hit. Waiting {wait_time:.0f}s..."
+                print(msg)
+                if update_callback: update_callback(msg)
+                backoff.pause(wait_time)
+
+        try:
+            # .text raises ValueError for a blocked/empty candidate, as do JSON decode errors
+            items = fast_json.loads(response.text)
+            if not isinstance(items, list) or not all(
+                isinstance(it, dict) and isinstance(it.get('topic'), str) and isinstance(it.get('summary'), str) for it in items
+            ):
+                raise ValueError("Model returned data in an unexpected format.")
+        except ValueError as e:
+            print(f"Single-call research failed, falling back to per-topic research: {e}")
+            return None
+        return [{'topic': it['topic'], 'summary': it['summary']} for it in items[:3]]
+
+    def research_topic(self, sub_topic: str, update_callback=None, backoff: Backoff = None,
+                       partial_cb=None, use_search: bool = True, max_retries: int = 3) -> str:
+        """
+        Researches one sub-topic, grounded with Google Search when a supported tool exists.
+        Retries rate limits and transient errors with backoff; pass the same `backoff` for every
+        sub-topic of one run so they share its cooldown. Returns RESEARCH_FAILED after max_retries.
+        Raises DailyQuotaExhausted when the daily quota is gone.
+        `partial_cb(delta, reset=False)` gets the streamed text; reset=True precedes each retry.
+        """
+        backoff = backoff or Backoff(sleep=self.sleep)
+        model = self.model(self.research_model_name)
+        prompt = (
+            f"Gather detailed information on this topic. Provide a comprehensive summary ({self.summary_length}). "
+            "Focus on facts and figures. Cite sources if available."
+            f'\nTopic: "{sub_topic}"'
+        )
+
+        attempt = 1
+        retrying = False
+        while attempt <= max_retries:
+            backoff.wait()
+            if backoff.stopped:
+                # The workflow was aborted (e.g. daily quota gone) while this request was waiting
+                return RESEARCH_FAILED
+            if partial_cb and retrying:
+                # Clear what a failed streamed attempt already showed before streaming again
+                partial_cb("", reset=True)
+            retrying = True
+            tool = self.search_tool if use_search else None
+            try:
+                if tool is not None:
+                    return self._generate_text(model, prompt, partial_cb, tools=[tool])
+                return self._generate_text(model, prompt, partial_cb)
+            except TooManyRequests as e:
+                wait_time = _quota_wait(e, attempt, backoff, last_attempt=attempt == max_retries)
+                if wait_time is None:
+                    # No retry left, so waiting would only delay the failure
+                    print(f"Rate limited on the last attempt for {sub_topic}; giving up.")
+                    break
+                msg = f"⚠️ API Rate limit hit. Waiting {wait_time:.0f}s..."
+                print(msg)
+                if update_callback: update_callback(msg)
+                backoff.pause(wait_time)
+            except Exception as e:
+                if tool is not None and _is_tool_unsupported(e):
+                    # Not the topic's fault: retry right away with the next tool (or none)
+                    print("Tool not supported. Retrying with the next search tool or without tools.")
+                    self._drop_search_tool(tool)
+                    continue
+                print(f"Attempt {attempt} failed for {sub_topic}: {e}")
+                if attempt == max_retries:
+                    break
+                backoff.pause(backoff.error_delay(attempt))
+            attempt += 1
+
+        return RESEARCH_FAILED
+
+    def synthesize_report(self, main_topic: str, research_data: str, chunk_cb=None, high_quality: bool = False) -> str:
+        """
+        Turns the research notes into a Markdown report, streaming deltas to chunk_cb if given.
+        Raises ValueError without calling the API when there are no notes.
+        """
+        if not research_data or research_data.isspace():
+            raise ValueError("No research notes to synthesize.")
+        model = self.model(self.high_quality_model_name if high_quality else self.synthesis_model_name)
+        prompt = "".join((_SYNTHESIS_PROMPT_PREFIX, main_topic, _SYNTHESIS_PROMPT_NOTES, research_data))
+        return self._generate_text(model, prompt, chunk_cb)
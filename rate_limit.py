@@ -0,0 +1,101 @@
+# rate_limit.py
+
+# Shared client-side rate limiting and retry backoff for Gemini calls.
+
+import time
+import random
+import threading
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. `rate` is tokens per second, `capacity` the burst size.
+    acquire() blocks until a token is available, so callers never need fixed sleeps.
+    `sleep` lets async servers pass a cooperative sleep (e.g. socketio.sleep).
+    With a `parent` bucket, each token also takes one from the parent, so a slower
+    low-priority bucket still counts against the shared limit.
+    """
+
+    def __init__(self, rate: float, capacity: int, sleep=time.sleep, parent=None):
+        self.rate = rate
+        self.capacity = capacity
+        self.sleep = sleep
+        self.parent = parent
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    break
+                wait = (1 - self.tokens) / self.rate
+            self.sleep(wait)
+        if self.parent:
+            self.parent.acquire()
+
+
+class Backoff:
+    """
+    Capped exponential backoff with jitter, shared by every request in one research workflow.
+    Rate-limit waits never drop below the largest backoff already used in the workflow, and
+    wait() holds back new requests until the most recent rate-limit cooldown has passed.
+    stop() aborts the workflow: pending and future pause()/wait() calls return right away.
+    """
+
+    # Longest single sleep inside pause(), so a stop() is noticed within this many seconds
+    STOP_POLL_SECONDS = 1.0
+
+    def __init__(self, sleep=time.sleep):
+        self.sleep = sleep
+        self.floor = 0.0
+        self.resume_at = 0.0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    @property
+    def stopped(self) -> bool:
+        return self._stopped.is_set()
+
+    def stop(self):
+        """Tells every request in this workflow to give up instead of sleeping through its retries."""
+        self._stopped.set()
+
+    def pause(self, seconds: float) -> bool:
+        """Sleeps for `seconds` in short slices. Returns False if stop() cut the sleep short."""
+        deadline = time.monotonic() + seconds
+        while not self.stopped:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return True
+            self.sleep(min(remaining, self.STOP_POLL_SECONDS))
+        return False
+
+    def error_delay(self, attempt: int) -> float:
+        """Delay before retrying after a generic (non rate-limit) error."""
+        return min(60, 2 ** attempt) + random.uniform(0, 2)
+
+    def rate_limit_delay(self, attempt: int, retry_delay: float = None) -> float:
+        """
+        Delay before retrying after a 429. A server-provided `retry_delay` is used as-is;
+        otherwise min(600, 30 * 2**attempt), raised to the workflow floor, plus jitter.
+        """
+        with self._lock:
+            if retry_delay is not None:
+                delay = retry_delay
+            else:
+                self.floor = max(self.floor, min(600, 30 * 2 ** attempt))
+                delay = self.floor + random.uniform(0, 5)
+            self.resume_at = max(self.resume_at, time.monotonic() + delay)
+        return delay
+
+    def wait(self):
+        """Blocks until any cooldown set by another request in this workflow has passed."""
+        remaining = self.resume_at - time.monotonic()
+        if remaining > 0:
+            self.pause(remaining)
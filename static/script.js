@@ -4,12 +4,16 @@ document.addEventListener('DOMContentLoaded', () => {
   // DOM elements
   const topicInput = document.getElementById('topic-input');
   const startResearchBtn = document.getElementById('start-research-btn');
+  const searchGroundingInput = document.getElementById('search-grounding-input');
+  const highQualityInput = document.getElementById('high-quality-input');
+  const forceRefreshInput = document.getElementById('force-refresh-input');
   const errorMessage = document.getElementById('error-message');
   const statusMessage = document.getElementById('status-message');
   const subtopicListContainer = document.getElementById('subtopic-list-container');
   const reportContainer = document.getElementById('report-container');
 
   let currentTopic = '';
+  let streamedReport = '';
 
   // SVG icons
   const icons = {
@@ -23,6 +27,9 @@ document.addEventListener('DOMContentLoaded', () => {
   // UI State
   const setUIState = (isResearching) => {
     topicInput.disabled = isResearching;
+    searchGroundingInput.disabled = isResearching;
+    highQualityInput.disabled = isResearching;
+    forceRefreshInput.disabled = isResearching;
     startResearchBtn.disabled = isResearching || !topicInput.value.trim();
     startResearchBtn.classList.toggle('cursor-wait', isResearching);
 
@@ -38,6 +45,7 @@ document.addEventListener('DOMContentLoaded', () => {
     subtopicListContainer.innerHTML = '';
     reportContainer.innerHTML = '';
     reportContainer.style.display = 'none';
+    streamedReport = '';
     statusMessage.textContent = 'Ready to start your research.';
     setUIState(false);
   };
@@ -66,12 +74,33 @@ document.addEventListener('DOMContentLoaded', () => {
     updateSubTopicStatus(data.index, data.status);
   });
 
+  socket.on('sub_topic_partial', (data) => {
+    const ul = document.getElementById('subtopics-ul');
+    const preview = ul && ul.children[data.index] && ul.children[data.index].querySelector('.subtopic-preview');
+    if (!preview) return;
+    // A retried attempt starts over, so drop the failed attempt's text first
+    if (data.reset) preview.textContent = '';
+    preview.textContent += data.delta;
+  });
+
+  socket.on('report_chunk', (data) => {
+    streamedReport += data.delta;
+    renderReport(streamedReport);
+  });
+
   socket.on('final_report', (data) => {
     renderReport(data.report);
     setStatusColor('bg-emerald-500');
     setUIState(false);
   });
 
+  socket.on('quota_exhausted', (data) => {
+    errorMessage.textContent = data.message;
+    statusMessage.textContent = 'API quota exhausted.';
+    setStatusColor('bg-rose-500');
+    setUIState(false);
+  });
+
   socket.on('research_error', (data) => {
     errorMessage.textContent = data.error;
     statusMessage.textContent = 'An error occurred.';
@@ -79,6 +108,11 @@ document.addEventListener('DOMContentLoaded', () => {
     setUIState(false);
   });
 
+  // Coalesced server events: [[event, payload], ...] in the order they were emitted
+  socket.on('event_batch', (batch) => {
+    batch.forEach(([event, data]) => socket.listeners(event).forEach((handler) => handler(data)));
+  });
+
   // Render functions
   const renderSubTopicList = (subTopics) => {
     const html = `
@@ -87,8 +121,11 @@ document.addEventListener('DOMContentLoaded', () => {
         <ul id="subtopics-ul" class="mt-4 space-y-3">
           ${subTopics.map(subTopic => `
             <li class="flex items-center justify-between p-3 bg-white dark:bg-zinc-800 rounded-lg border-l-4 border-gray-300 dark:border-zinc-600">
-              <span class="text-sm text-gray-800 dark:text-gray-300">${subTopic.topic}</span>
-              <div class="flex items-center gap-2 text-sm font-medium text-gray-500 dark:text-gray-400">
+              <div class="min-w-0 flex-1 pr-4">
+                <span class="text-sm text-gray-800 dark:text-gray-300">${subTopic.topic}</span>
+                <p class="subtopic-preview text-xs text-gray-500 dark:text-gray-400 truncate"></p>
+              </div>
+              <div class="subtopic-status flex items-center gap-2 text-sm font-medium text-gray-500 dark:text-gray-400">
                 ${icons.dot}
                 <span class="capitalize">pending</span>
               </div>
@@ -105,7 +142,7 @@ document.addEventListener('DOMContentLoaded', () => {
     if (!ul || !ul.children[index]) return;
 
     const listItem = ul.children[index];
-    const statusDiv = listItem.querySelector('div');
+    const statusDiv = listItem.querySelector('.subtopic-status');
 
     const statusInfo = {
       'pending': { icon: icons.dot, text: 'pending', color: 'text-gray-500 dark:text-gray-400', border: 'border-gray-300 dark:border-zinc-600' },
@@ -117,7 +154,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const currentStatus = statusInfo[status];
     if (currentStatus) {
       listItem.className = `flex items-center justify-between p-3 bg-white dark:bg-zinc-800 rounded-lg border-l-4 ${currentStatus.border}`;
-      statusDiv.className = `flex items-center gap-2 text-sm font-medium ${currentStatus.color}`;
+      statusDiv.className = `subtopic-status flex items-center gap-2 text-sm font-medium ${currentStatus.color}`;
       statusDiv.innerHTML = `${currentStatus.icon}<span class="capitalize">${currentStatus.text}</span>`;
     }
   };
@@ -159,7 +196,12 @@ document.addEventListener('DOMContentLoaded', () => {
     currentTopic = topic;
     resetUI();
     setUIState(true);
-    socket.emit('start_research', { topic });
+    socket.emit('start_research', {
+      topic,
+      search_grounding: searchGroundingInput.checked,
+      quality: highQualityInput.checked ? 'high' : 'fast',
+      force_refresh: forceRefreshInput.checked
+    });
   };
 
   startResearchBtn.addEventListener('click', startResearch);
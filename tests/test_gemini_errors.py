@@ -0,0 +1,70 @@
+# tests/test_gemini_errors.py
+
+# parse_retry_info needs no network: the 429 details are built by hand in both formats Gemini uses.
+# Run with: python -m unittest discover -s tests
+
+import unittest
+from types import SimpleNamespace
+
+from google.protobuf import duration_pb2
+from google.rpc import error_details_pb2
+
+from gemini_errors import parse_retry_info
+
+
+def _err(*details):
+    return SimpleNamespace(details=list(details))
+
+
+class ParseRetryInfoDictTests(unittest.TestCase):
+    """REST-style details: plain dicts keyed by '@type'."""
+
+    def test_retry_delay(self):
+        err = _err({'@type': 'type.googleapis.com/google.rpc.RetryInfo', 'retryDelay': '37s'})
+        self.assertEqual(parse_retry_info(err), (37.0, False))
+
+    def test_fractional_retry_delay(self):
+        err = _err({'@type': 'type.googleapis.com/google.rpc.RetryInfo', 'retryDelay': '1.5s'})
+        self.assertEqual(parse_retry_info(err), (1.5, False))
+
+    def test_malformed_retry_delay_is_ignored(self):
+        err = _err({'@type': 'type.googleapis.com/google.rpc.RetryInfo', 'retryDelay': 'soon'})
+        self.assertEqual(parse_retry_info(err), (None, False))
+
+    def test_daily_quota_violation(self):
+        err = _err(
+            {'@type': 'type.googleapis.com/google.rpc.QuotaFailure',
+             'violations': [{'quotaId': 'GenerateRequestsPerDayPerProjectPerModel-FreeTier'}]},
+            {'@type': 'type.googleapis.com/google.rpc.RetryInfo', 'retryDelay': '20s'},
+        )
+        self.assertEqual(parse_retry_info(err), (20.0, True))
+
+    def test_per_minute_violation_is_not_daily(self):
+        err = _err({'@type': 'type.googleapis.com/google.rpc.QuotaFailure',
+                    'violations': [{'quotaId': 'GenerateRequestsPerMinutePerProjectPerModel-FreeTier'}]})
+        self.assertEqual(parse_retry_info(err), (None, False))
+
+
+class ParseRetryInfoProtoTests(unittest.TestCase):
+    """gRPC-style details: unpacked google.rpc protos."""
+
+    def test_retry_delay(self):
+        info = error_details_pb2.RetryInfo(retry_delay=duration_pb2.Duration(seconds=12, nanos=500000000))
+        self.assertEqual(parse_retry_info(_err(info)), (12.5, False))
+
+    def test_daily_quota_violation(self):
+        failure = error_details_pb2.QuotaFailure(violations=[
+            error_details_pb2.QuotaFailure.Violation(subject='project', description='Requests per day exceeded'),
+        ])
+        self.assertEqual(parse_retry_info(_err(failure)), (None, True))
+
+
+class ParseRetryInfoEmptyTests(unittest.TestCase):
+
+    def test_no_details(self):
+        self.assertEqual(parse_retry_info(Exception("429 Resource exhausted")), (None, False))
+        self.assertEqual(parse_retry_info(_err()), (None, False))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,38 @@
+# tests/test_mariana_core.py
+
+# GeminiClient tests with a stand-in model, so no API key or network is needed.
+# Run with: python -m unittest discover -s tests
+
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import google.generativeai as genai
+
+import mariana_core
+from mariana_core import GeminiClient
+
+
+class ResearchTopicSearchToolTests(unittest.TestCase):
+
+    def setUp(self):
+        # A Tool whose only field is an empty message is falsy, which must not disable grounding
+        self.tool = genai.protos.Tool(google_search_retrieval=genai.protos.GoogleSearchRetrieval())
+        with mock.patch.object(mariana_core, "_search_tool_candidates", return_value=[self.tool]):
+            self.client = GeminiClient("gemini-test", sleep=lambda seconds: None)
+        self.model = mock.Mock()
+        self.model.generate_content.return_value = SimpleNamespace(text="Grounded summary.")
+        self.client.model = lambda model_name=None: self.model
+
+    def test_use_search_passes_the_search_tool(self):
+        summary = self.client.research_topic("Ocean trenches", use_search=True)
+        self.assertEqual(summary, "Grounded summary.")
+        self.assertEqual(self.model.generate_content.call_args.kwargs.get("tools"), [self.tool])
+
+    def test_without_search_no_tools_are_sent(self):
+        self.client.research_topic("Ocean trenches", use_search=False)
+        self.assertNotIn("tools", self.model.generate_content.call_args.kwargs)
+
+
+if __name__ == "__main__":
+    unittest.main()